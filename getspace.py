@@ -9,19 +9,20 @@ if __name__ == '__main__':
     bili.login_with_cookie()
     res = bili.get_vids("67390259", "1")
 
-    video_list = []
+    localtime = time.localtime
+    strftime = time.strftime
 
-    for x in res.get("list").get("vlist"):
-        x.get("pic")
-        video_info = {
-            "aid": x.get("pic"),
+    video_list = [
+        {
+            "aid": x.get("aid"),
             "title": x.get("title"),
             "cover": x.get("pic"),
             "desc": x.get("description"),
             "tags": [],
             "cid": None,
-            "created_at": time.strftime("%Y-%m-%d %H:%M", time.localtime(x.get("created"))),
-            "created_timestamp": x.get("created")
+            "created_at": strftime("%Y-%m-%d %H:%M", localtime(created := x.get("created"))),
+            "created_timestamp": created
         }
-        video_list.append(video_info)
+        for x in res.get("list").get("vlist")
+    ]
     print(video_list)
@@ -5,60 +5,173 @@ B站完整弹幕下载器 - 修正版
 模拟 jijidown_dm_fix.js 的逻辑：先获取实时弹幕，再从发布日期开始智能获取历史弹幕
 """
 
-import html
+import json
+import os
+import shutil
 import sys
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Set
+from operator import attrgetter
+from typing import List, Optional, Set
 
 import requests
 
+# 实时弹幕最多获取的分段数，以及同时在途的分段请求数
+MAX_SEGMENTS = 100
+SEGMENT_WORKERS = 8
+# 分段请求遇到 412（风控）时的重试次数与最长退避时间（秒）
+SEGMENT_RETRY = 3
+SEGMENT_MAX_BACKOFF = 8
+
+# 分段弹幕的本地缓存目录：<cid>/<segment_index>.pb 为响应内容，同名 .json 记录 ETag/Last-Modified
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'danmdown')
+# 最多保留的视频缓存数，超出时按最近使用时间淘汰最旧的 <cid> 目录
+CACHE_MAX_VIDEOS = 50
+
+# 与 html.escape(quote=True) 等价的转义表，str.translate 单次遍历即可完成
+XML_ESCAPE_TABLE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#x27;'})
+# 保存XML时的写缓冲区大小，数万条弹幕只需少量几次 write 系统调用
+XML_WRITE_BUFFER = 1 << 20
+
 
 class DanmakuElement:
     """弹幕元素类"""
-    def __init__(self, data: Dict):
-        self.id = data.get('id', 0)
-        self.progress = data.get('progress', 0)  # 毫秒
-        self.mode = data.get('mode', 1)
-        self.fontsize = data.get('fontsize', 25)
-        self.color = data.get('color', 16777215)
-        self.ctime = data.get('ctime', 0)
-        self.pool = data.get('pool', 0)
-        self.midHash = data.get('midHash', '')
-        self.content = data.get('content', '')
-        self.weight = data.get('weight', 0)
+    # 下载一个视频往往会产生数万个弹幕对象，使用 __slots__ 省去每个对象的 __dict__
+    __slots__ = ('id', 'progress', 'mode', 'fontsize', 'color', 'ctime',
+                 'pool', 'midHash', 'content', 'weight')
+
+    # 参数顺序与 __slots__ 一致，解码器按位置传入各字段
+    def __init__(self, id: int = 0, progress: int = 0, mode: int = 1, fontsize: int = 25,
+                 color: int = 16777215, ctime: int = 0, pool: int = 0, midHash: str = '',
+                 content: str = '', weight: int = 0):
+        self.id = id
+        self.progress = progress  # 毫秒
+        self.mode = mode
+        self.fontsize = fontsize
+        self.color = color
+        self.ctime = ctime
+        self.pool = pool
+        self.midHash = midHash
+        self.content = content
+        self.weight = weight
 
     def to_xml_element(self) -> str:
         """转换为XML弹幕格式"""
-        p_attr = f"{self.progress / 1000:.3f},{self.mode},{self.fontsize},{self.color},{self.ctime},{self.pool},{self.midHash},{self.id}"
-        content_escaped = html.escape(self.content)
-        return f'<d p="{p_attr}">{content_escaped}</d>'
+        return '<d p="%.3f,%d,%d,%d,%d,%d,%s,%d">%s</d>' % (
+            self.progress / 1000, self.mode, self.fontsize, self.color, self.ctime,
+            self.pool, self.midHash, self.id, self.content.translate(XML_ESCAPE_TABLE))
 
-    def get_unique_id(self) -> str:
+    def get_unique_id(self) -> int:
         """生成唯一标识，用于去重（模拟JS版本的逻辑）"""
-        # 模拟 JS 版本的 generateDanmakuId 逻辑
-        return f"{self.progress or 1}_{len(self.content)}_{hash(self.midHash) % (2**32)}"
+        # 模拟 JS 版本的 generateDanmakuId 逻辑，但把三段信息打包成一个整数，
+        # 避免为每条弹幕格式化字符串：progress | len(content) 16位 | midHash 哈希 32位
+        return ((self.progress or 1) << 48) | (len(self.content) << 32) | (hash(self.midHash) & 0xFFFFFFFF)
+
+
+class DanmakuAccumulator:
+    """去重后的弹幕集合，模拟JS版本的mergeDanmakuInPlace
+
+    列表与唯一标识集合成对维护，整个下载流程只创建一次，各阶段依次合并。
+    """
+    __slots__ = ('items', 'seen', 'fetched')
+
+    def __init__(self):
+        self.items: List[DanmakuElement] = []
+        self.seen: Set[int] = set()
+        self.fetched = 0  # 累计合并过的原始弹幕数（含重复）
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def add_batch(self, batch: List[DanmakuElement]) -> int:
+        """合并一批弹幕，返回新增条数"""
+        old_count = len(self.items)
+        self.fetched += len(batch)
+        # 重复弹幕占多数时，循环开销主要在属性查找上，先绑定为局部变量
+        seen = self.seen
+        add_id = seen.add
+        append = self.items.append
+        for danmaku in batch:
+            unique_id = danmaku.get_unique_id()
+            if unique_id not in seen:
+                append(danmaku)
+                add_id(unique_id)
+        return len(self.items) - old_count
+
+
+# 弹幕元素字段映射（field_number -> 属性名）
+VARINT_FIELDS = {1: 'id', 2: 'progress', 3: 'mode', 4: 'fontsize',
+                 5: 'color', 8: 'ctime', 9: 'weight', 11: 'pool'}
+STRING_FIELDS = {6: 'midHash', 7: 'content', 12: 'idStr'}
+
+
+# 解码器按位置构造 DanmakuElement，要求 __init__ 的参数顺序与 __slots__ 完全一致
+assert DanmakuElement.__init__.__code__.co_varnames[1:len(DanmakuElement.__slots__) + 1] == DanmakuElement.__slots__
+# DanmakuElement 各字段的默认值，按 __slots__ 顺序排列
+ELEMENT_DEFAULTS = DanmakuElement.__init__.__defaults__
+assert len(ELEMENT_DEFAULTS) == len(DanmakuElement.__slots__)
+
+
+def _build_tag_table() -> tuple:
+    """以原始 tag（field_number << 3 | wire_type）为下标的字段表，元素为 (字段下标, wire_type)
+
+    字段下标即属性在 DanmakuElement.__slots__ 中的位置；未知或不需要的字段为 None，
+    但保留其 wire_type 以便正确跳过。
+    """
+    slots = DanmakuElement.__slots__
+    table = [(None, tag & 0x7) for tag in range(256)]
+    for field_number, name in VARINT_FIELDS.items():
+        if name in slots:
+            table[field_number << 3] = (slots.index(name), 0)
+    for field_number, name in STRING_FIELDS.items():
+        if name in slots:
+            table[(field_number << 3) | 2] = (slots.index(name), 2)
+    return tuple(table)
+
+
+TAG_TABLE = _build_tag_table()
+# 已知但不保存到 DanmakuElement 的字段（如 idStr），出现时仍视为有效元素
+UNSTORED_STRING_TAGS = frozenset((field_number << 3) | 2 for field_number, name in STRING_FIELDS.items()
+                                 if name not in DanmakuElement.__slots__)
+
+
+def decode_varint(data: bytes, offset: int, end: Optional[int] = None) -> tuple:
+    """解码varint（单字节、双字节走快速路径），最多读到 end（默认到 data 末尾）"""
+    size = len(data) if end is None else end
+    if offset >= size:
+        return 0, offset
+
+    byte = data[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+
+    if offset + 1 >= size:
+        return byte & 0x7F, offset + 1
+
+    byte2 = data[offset + 1]
+    result = (byte & 0x7F) | ((byte2 & 0x7F) << 7)
+    if byte2 < 0x80:
+        return result, offset + 2
+
+    # 三字节及以上：接着已读的两个字节继续累加，不再从头重读
+    shift = 14
+    pos = offset + 2
+
+    while pos < size:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+
+    return result, pos
 
 
 class ProtobufDecoder:
     """简单的protobuf解码器"""
-    
-    @staticmethod
-    def decode_varint(data: bytes, offset: int) -> tuple:
-        """解码varint"""
-        result = 0
-        shift = 0
-        pos = offset
-        
-        while pos < len(data):
-            byte = data[pos]
-            pos += 1
-            result |= (byte & 0x7F) << shift
-            if (byte & 0x80) == 0:
-                break
-            shift += 7
-            
-        return result, pos
 
     @staticmethod
     def decode_string(data: bytes, offset: int, length: int) -> str:
@@ -76,21 +189,21 @@ class ProtobufDecoder:
         
         while pos < len(data):
             try:
-                field_tag, pos = cls.decode_varint(data, pos)
+                field_tag, pos = decode_varint(data, pos)
                 field_number = field_tag >> 3
                 wire_type = field_tag & 0x7
                 
                 if field_number == 1 and wire_type == 2:  # elems字段
-                    length, pos = cls.decode_varint(data, pos)
-                    danmaku_data = cls.decode_danmaku_element(data[pos:pos + length])
-                    if danmaku_data:
-                        danmaku_list.append(DanmakuElement(danmaku_data))
+                    length, pos = decode_varint(data, pos)
+                    danmaku = cls.decode_danmaku_element(data, pos, pos + length)
+                    if danmaku is not None:
+                        danmaku_list.append(danmaku)
                     pos += length
                 else:
                     if wire_type == 0:
-                        _, pos = cls.decode_varint(data, pos)
+                        _, pos = decode_varint(data, pos)
                     elif wire_type == 2:
-                        length, pos = cls.decode_varint(data, pos)
+                        length, pos = decode_varint(data, pos)
                         pos += length
                     else:
                         break
@@ -101,43 +214,49 @@ class ProtobufDecoder:
         return danmaku_list
 
     @classmethod
-    def decode_danmaku_element(cls, data: bytes) -> Optional[Dict]:
-        """解码单个弹幕元素"""
-        element = {}
-        pos = 0
+    def decode_danmaku_element(cls, data: bytes, offset: int, end: int) -> Optional[DanmakuElement]:
+        """解码单个弹幕元素（直接在响应缓冲区的 [offset, end) 区间内解码，避免切片拷贝）
+
+        所有读取都限制在 end 之内，与按元素切片解码的结果一致，不会越界读到下一个元素。
+        字段值按 __slots__ 顺序写入列表后直接构造 DanmakuElement，不经过中间字典。
+        """
+        values = list(ELEMENT_DEFAULTS)
+        found = False
+        pos = offset
+        end = min(end, len(data))
         
-        while pos < len(data):
+        while pos < end:
             try:
-                field_tag, pos = cls.decode_varint(data, pos)
-                field_number = field_tag >> 3
-                wire_type = field_tag & 0x7
+                field_tag, pos = decode_varint(data, pos, end)
+                slot, wire_type = TAG_TABLE[field_tag] if field_tag < 256 else (None, field_tag & 0x7)
                 
                 if wire_type == 0:  # varint
-                    value, pos = cls.decode_varint(data, pos)
-                    field_map = {1: 'id', 2: 'progress', 3: 'mode', 4: 'fontsize', 
-                               5: 'color', 8: 'ctime', 9: 'weight', 11: 'pool'}
-                    if field_number in field_map:
-                        element[field_map[field_number]] = value
+                    value, pos = decode_varint(data, pos, end)
+                    if slot is not None:
+                        values[slot] = value
+                        found = True
                         
                 elif wire_type == 2:  # length-delimited (string)
-                    length, pos = cls.decode_varint(data, pos)
-                    string_value = cls.decode_string(data, pos, length)
-                    string_map = {6: 'midHash', 7: 'content', 12: 'idStr'}
-                    if field_number in string_map:
-                        element[string_map[field_number]] = string_value
+                    length, pos = decode_varint(data, pos, end)
+                    if slot is not None:
+                        values[slot] = cls.decode_string(data, pos, min(length, end - pos))
+                        found = True
+                    elif field_tag in UNSTORED_STRING_TAGS:
+                        found = True
                     pos += length
                 else:
                     break
             except Exception:
                 break
                 
-        return element if element else None
+        return DanmakuElement(*values) if found else None
 
 
 class BilibiliDanmakuDownloader:
     """B站完整弹幕下载器 - 模拟jijidown_dm_fix.js逻辑"""
     
-    def __init__(self):
+    def __init__(self, use_cache: bool = True):
+        self.use_cache = use_cache  # 是否使用 CACHE_DIR 下的分段缓存
         # 待写 通过外部导入 cookies
         cookies = {}
         self.session = requests.Session()
@@ -153,21 +272,6 @@ class BilibiliDanmakuDownloader:
             'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
             'Accept-Encoding': 'gzip, deflate, br'
         })
-        self.id_pool: Set[str] = set()  # 用于去重，模拟JS版本
-
-    def merge_danmaku_in_place(self, target_list: List[DanmakuElement], new_list: List[DanmakuElement]):
-        """原地合并弹幕列表，模拟JS版本的mergeDanmakuInPlace函数"""
-        if not hasattr(target_list, 'id_pool'):
-            # 初始化id_pool
-            for danmaku in target_list:
-                unique_id = danmaku.get_unique_id()
-                self.id_pool.add(unique_id)
-        
-        for danmaku in new_list:
-            unique_id = danmaku.get_unique_id()
-            if unique_id not in self.id_pool:
-                target_list.append(danmaku)
-                self.id_pool.add(unique_id)
 
     def get_current_danmaku_info(self, cid: int) -> tuple:
         """获取当前弹幕信息，由于XML API已废弃，改为通过实时弹幕接口估算"""
@@ -193,63 +297,199 @@ class BilibiliDanmakuDownloader:
             print(f"获取弹幕信息失败: {e}")
             return 5000, []
 
-    def get_segmented_danmaku(self, cid: int) -> List[DanmakuElement]:
-        """获取分段弹幕（实时弹幕），模拟JS版本的getSegmentedDanmaku"""
-        danmaku_list = []
-        segment_index = 1
+    def _fetch_segment(self, cid: int, segment_index: int) -> tuple:
+        """获取并解码单个分段，返回 (状态码, 响应内容, 解码后的弹幕列表)
+
+        在工作线程中直接解码，使解码与其他分段的网络等待重叠进行。
+        响应内容缓存在 CACHE_DIR 下，再次获取时服务端返回 304 则读取本地缓存。
+        """
+        url = f"https://api.bilibili.com/x/v2/dm/web/seg.so?type=1&oid={cid}&segment_index={segment_index}"
+        body_path, meta_path = self._segment_cache_paths(cid, segment_index)
+        
+        # 有缓存时带上校验头，服务端返回 304 即可直接使用本地内容
+        headers = {}
+        meta = self._load_segment_meta(body_path, meta_path) if self.use_cache else {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        
+        response = self._request_segment(url, headers)
+        status_code = response.status_code
+        content = response.content
+        
+        if status_code == 304 and headers:
+            try:
+                with open(body_path, 'rb') as f:
+                    content = f.read()
+                status_code = 200
+            except OSError as e:
+                # 服务端确认内容存在，本地缓存却不可用：按缓存未命中处理，重新完整下载
+                print(f"分段 {segment_index}: 读取缓存失败，重新下载: {e}")
+                response = self._request_segment(url, {})
+                status_code = response.status_code
+                content = response.content
+        
+        if self.use_cache and response.status_code == 200 and content:
+            self._store_segment(segment_index, body_path, meta_path, content, response.headers)
+        
+        segment_danmaku = []
+        if status_code == 200 and content:
+            segment_danmaku = ProtobufDecoder.decode_danmaku_response(content)
+        return status_code, content, segment_danmaku
+
+    def _request_segment(self, url: str, headers: dict):
+        """请求分段，遇到 412 时按指数退避重试，重试用尽后返回最后一次响应"""
+        for attempt in range(SEGMENT_RETRY + 1):
+            response = self.session.get(url, timeout=10, headers=headers)
+            if response.status_code != 412 or attempt == SEGMENT_RETRY:
+                return response
+            time.sleep(min(2 ** attempt, SEGMENT_MAX_BACKOFF))
+
+    @staticmethod
+    def _touch_segment_cache(cid: int) -> None:
+        """刷新视频缓存目录的修改时间，作为淘汰时的最近使用时间"""
+        try:
+            os.utime(os.path.join(CACHE_DIR, str(cid)))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _prune_segment_cache(keep: int = CACHE_MAX_VIDEOS) -> None:
+        """只保留最近使用的 keep 个视频的分段缓存，删除其余 <cid> 目录"""
+        try:
+            entries = [entry for entry in os.scandir(CACHE_DIR) if entry.is_dir()]
+        except OSError:
+            return
+        # 先取出各目录的修改时间；期间被其他进程删除的目录直接跳过
+        dated = []
+        for entry in entries:
+            try:
+                dated.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue
+        dated.sort(reverse=True)
+        for _, path in dated[keep:]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def _segment_cache_paths(cid: int, segment_index: int) -> tuple:
+        """返回分段缓存的 (内容文件, 元数据文件) 路径"""
+        cache_dir = os.path.join(CACHE_DIR, str(cid))
+        return (os.path.join(cache_dir, f"{segment_index}.pb"),
+                os.path.join(cache_dir, f"{segment_index}.json"))
+
+    @staticmethod
+    def _load_segment_meta(body_path: str, meta_path: str) -> dict:
+        """读取分段缓存的校验信息，缓存不完整时返回空字典"""
+        if not os.path.exists(body_path):
+            return {}
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _store_segment(segment_index: int, body_path: str, meta_path: str, content: bytes, headers) -> None:
+        """写入分段缓存，仅在响应带有 ETag 或 Last-Modified 时缓存"""
+        meta = {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+        if not meta['etag'] and not meta['last_modified']:
+            return
+        # 先写临时文件再替换，避免中断时留下与元数据不符的内容
+        tmp_path = body_path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, body_path)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+        except OSError as e:
+            print(f"分段 {segment_index}: 写入缓存失败: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def get_segmented_danmaku(self, cid: int,
+                              acc: Optional[DanmakuAccumulator] = None) -> List[DanmakuElement]:
+        """获取分段弹幕（实时弹幕），模拟JS版本的getSegmentedDanmaku
+
+        各分段互不依赖，使用线程池保持 SEGMENT_WORKERS 个请求同时在途，
+        但仍按分段顺序处理结果，停止条件与逐段获取时一致。
+        新弹幕合并进 acc，返回本阶段新增的弹幕。
+        """
+        if acc is None:
+            acc = DanmakuAccumulator()
+        start = len(acc)
         
         print("⚡ 正在获取实时弹幕...")
+        if self.use_cache:
+            self._touch_segment_cache(cid)
         
-        while segment_index <= 100:
-            url = f"https://api.bilibili.com/x/v2/dm/web/seg.so?type=1&oid={cid}&segment_index={segment_index}"
+        pool = ThreadPoolExecutor(max_workers=SEGMENT_WORKERS)
+        pending = deque()
+        next_index = 1
+        while next_index <= MAX_SEGMENTS and len(pending) < SEGMENT_WORKERS:
+            pending.append((next_index, pool.submit(self._fetch_segment, cid, next_index)))
+            next_index += 1
+        
+        while pending:
+            segment_index, future = pending.popleft()
             
             try:
-                response = self.session.get(url, timeout=10)
+                status_code, content, segment_danmaku = future.result()
                 
-                if response.status_code == 304:
+                if status_code == 304:
                     print(f"分段 {segment_index}: 无新内容 (304)，停止获取")
                     break
-                elif response.status_code != 200:
-                    print(f"分段 {segment_index}: HTTP错误 {response.status_code}")
-                    if response.status_code == 412:
+                elif status_code != 200:
+                    print(f"分段 {segment_index}: HTTP错误 {status_code}")
+                    if status_code == 412:
                         print("可能需要重新登录或验证cookies")
                     break
                 
-                if len(response.content) == 0:
+                if len(content) == 0:
                     print(f"分段 {segment_index}: 响应为空，停止获取")
                     break
                 
-                segment_danmaku = ProtobufDecoder.decode_danmaku_response(response.content)
-                
                 if not segment_danmaku:
                     print(f"分段 {segment_index}: 解码后无弹幕数据，停止获取")
                     break
                 
-                old_count = len(danmaku_list)
-                self.merge_danmaku_in_place(danmaku_list, segment_danmaku)
-                new_count = len(danmaku_list) - old_count
+                new_count = acc.add_batch(segment_danmaku)
                 
-                print(f"分段 {segment_index}: 获取 {len(segment_danmaku)} 条，新增 {new_count} 条，总计 {len(danmaku_list)} 条")
+                print(f"分段 {segment_index}: 获取 {len(segment_danmaku)} 条，新增 {new_count} 条，总计 {len(acc) - start} 条")
                 
                 # 如果连续几段都没有新增，可能已经获取完毕
                 if new_count == 0:
                     print(f"分段 {segment_index}: 无新增弹幕，可能已获取完毕")
                     break
                 
-                segment_index += 1
-                time.sleep(0.5)
+                if next_index <= MAX_SEGMENTS:
+                    pending.append((next_index, pool.submit(self._fetch_segment, cid, next_index)))
+                    next_index += 1
                 
             except Exception as e:
                 print(f"获取分段 {segment_index} 弹幕失败: {e}")
                 break
         
-        print(f"实时弹幕获取完成: {len(danmaku_list)}条")
-        return danmaku_list
+        # 已经停止获取，丢弃尚未开始的请求
+        pool.shutdown(wait=False, cancel_futures=True)
+        
+        if self.use_cache:
+            self._touch_segment_cache(cid)
+            self._prune_segment_cache()
+        
+        print(f"实时弹幕获取完成: {len(acc) - start}条")
+        return acc.items[start:]
 
     def get_history_danmaku_js_style(self, cid: int, video_date: Optional[datetime], 
                                    start_days: int = 0, end_days: int = 1, 
-                                   target_count: int = 5000) -> List[DanmakuElement]:
-        """模拟JS版本的历史弹幕获取逻辑"""
+                                   target_count: int = 5000,
+                                   acc: Optional[DanmakuAccumulator] = None) -> List[DanmakuElement]:
+        """模拟JS版本的历史弹幕获取逻辑，新弹幕合并进 acc，返回本阶段新增的弹幕"""
         if not video_date:
             print("未提供视频发布日期，跳过历史弹幕获取")
             return []
@@ -260,7 +500,9 @@ class BilibiliDanmakuDownloader:
         else:
             print("使用默认时段: 从发布日期开始")
         
-        aldanmu = []  # 所有历史弹幕
+        if acc is None:
+            acc = DanmakuAccumulator()
+        start = len(acc)  # acc 中此前各阶段的弹幕数
         ldanmu = []   # 当前查询的弹幕
         first_date = 0
         ondanmu = target_count  # 目标弹幕数
@@ -306,8 +548,8 @@ class BilibiliDanmakuDownloader:
                             
                             if ldanmu:
                                 # 合并弹幕
-                                self.merge_danmaku_in_place(aldanmu, ldanmu)
-                                print(f"{date_str}: +{len(ldanmu)}条，总计{len(aldanmu)}条")
+                                acc.add_batch(ldanmu)
+                                print(f"{date_str}: +{len(ldanmu)}条，总计{len(acc) - start}条")
                                 
                                 # 关键：模拟JS逻辑，根据弹幕时间戳调整下次查询日期
                                 min_ctime = min(d.ctime for d in ldanmu)
@@ -347,8 +589,8 @@ class BilibiliDanmakuDownloader:
             if first_date == 0:
                 current_date -= timedelta(days=1)
         
-        print(f"历史弹幕获取完成: {len(aldanmu)}条")
-        return aldanmu
+        print(f"历史弹幕获取完成: {len(acc) - start}条")
+        return acc.items[start:]
 
     def get_complete_danmaku_js_style(self, cid: int, video_date: Optional[datetime] = None, 
                                     start_days: int = 0, end_days: int = None) -> List[DanmakuElement]:
@@ -365,51 +607,42 @@ class BilibiliDanmakuDownloader:
         # 1. 获取弹幕信息（估算）
         maxlimit, current_danmaku = self.get_current_danmaku_info(cid)
         
-        all_danmaku_lists = []
+        # 各阶段共用同一个累加器，边获取边去重，无需最后再整体合并
+        acc = DanmakuAccumulator()
+        stage_counts = []
         if current_danmaku:
-            all_danmaku_lists.append(current_danmaku)
+            stage_counts.append(("当前弹幕", len(current_danmaku), acc.add_batch(current_danmaku)))
         
         # 2. 先获取实时弹幕（与JS版本顺序一致）
         print("⚡ 首先获取实时弹幕...")
-        segmented_danmaku = self.get_segmented_danmaku(cid)
+        fetched_before = acc.fetched
+        segmented_danmaku = self.get_segmented_danmaku(cid, acc)
         if segmented_danmaku:
-            all_danmaku_lists.append(segmented_danmaku)
+            stage_counts.append(("实时弹幕", acc.fetched - fetched_before, len(segmented_danmaku)))
             print(f"实时弹幕获取完成: {len(segmented_danmaku)} 条")
         
         # 3. 获取历史弹幕作为补充
         if video_date and maxlimit > 0:
-            history_danmaku = self.get_history_danmaku_js_style(cid, video_date, start_days, end_days, maxlimit)
+            fetched_before = acc.fetched
+            history_danmaku = self.get_history_danmaku_js_style(cid, video_date, start_days, end_days, maxlimit, acc)
             if history_danmaku:
-                all_danmaku_lists.append(history_danmaku)
+                stage_counts.append(("历史弹幕", acc.fetched - fetched_before, len(history_danmaku)))
                 print(f"历史弹幕作为补充: {len(history_danmaku)} 条")
         
-        # 4. 合并所有弹幕
+        # 4. 汇总各阶段结果
         print("🔄 正在合并弹幕数据...")
-        merged_danmaku = []
-        id_pool = set()
+        for list_name, total, new_count in stage_counts:
+            print(f"  {list_name}: 原始 {total} 条，新增 {new_count} 条")
         
-        for i, danmaku_list in enumerate(all_danmaku_lists):
-            list_name = ["当前弹幕", "实时弹幕", "历史弹幕"][i] if i < 3 else f"列表{i+1}"
-            old_count = len(merged_danmaku)
-            
-            for danmaku in danmaku_list:
-                unique_id = danmaku.get_unique_id()
-                if unique_id not in id_pool:
-                    id_pool.add(unique_id)
-                    merged_danmaku.append(danmaku)
-            
-            new_count = len(merged_danmaku) - old_count
-            print(f"  {list_name}: 原始 {len(danmaku_list)} 条，新增 {new_count} 条")
-        
-        print(f"✅ 合并完成！共获取 {len(merged_danmaku)} 条弹幕")
-        return merged_danmaku
+        print(f"✅ 合并完成！共获取 {len(acc)} 条弹幕")
+        return acc.items
 
     def save_danmaku_xml(self, danmaku_list: List[DanmakuElement], filename: str, cid: int):
         """保存弹幕为XML格式"""
-        # 按播放时间排序
-        danmaku_list.sort(key=lambda x: x.progress)
+        # 按播放时间排序（稳定排序，attrgetter 在C层取键，不必逐条调用lambda）
+        danmaku_list.sort(key=attrgetter('progress'))
         
-        xml_content = [
+        xml_header = [
             '<?xml version="1.0" encoding="UTF-8"?>',
             '<i>',
             '<chatserver>chat.bilibili.com</chatserver>',
@@ -422,13 +655,11 @@ class BilibiliDanmakuDownloader:
             f'<info>{{"cid": {cid}, "total": {len(danmaku_list)}, "download_time": "{datetime.now().isoformat()}"}}</info>'
         ]
         
-        for danmaku in danmaku_list:
-            xml_content.append(danmaku.to_xml_element())
-        
-        xml_content.append('</i>')
-        
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(xml_content))
+        # 逐条编码后直接写入缓冲文件，不在内存中拼接整份XML
+        with open(filename, 'wb', buffering=XML_WRITE_BUFFER) as f:
+            f.write('\n'.join(xml_header).encode('utf-8'))
+            f.writelines(('\n' + danmaku.to_xml_element()).encode('utf-8') for danmaku in danmaku_list)
+            f.write(b'\n</i>')
         
         print(f"弹幕已保存到: {filename}")
 
@@ -441,6 +672,7 @@ def main():
         print("  --publish-date YYYY-MM-DD  指定视频发布日期")
         print("  --start-days N            从发布日期开始的天数（默认0）")
         print("  --end-days N              到发布日期的天数（默认从发布日期+1天开始）")
+        print("  --no-cache                不读取也不写入本地分段缓存")
         print("示例: python bilibili_danmaku_downloader.py 123456789")
         print("      python bilibili_danmaku_downloader.py 123456789 --publish-date 2023-01-01")
         print("      python bilibili_danmaku_downloader.py 123456789 --publish-date 2023-01-01 --start-days 0 --end-days 30")
@@ -456,6 +688,7 @@ def main():
     video_date = None
     start_days = 0
     end_days = None  # 默认为None，让逻辑自动处理
+    use_cache = True
     
     args = sys.argv[2:]
     i = 0
@@ -481,11 +714,14 @@ def main():
             except ValueError:
                 print("错误: --end-days 必须是整数")
                 sys.exit(1)
+        elif args[i] == '--no-cache':
+            use_cache = False
+            i += 1
         else:
             print(f"未知参数: {args[i]}")
             sys.exit(1)
     
-    downloader = BilibiliDanmakuDownloader()
+    downloader = BilibiliDanmakuDownloader(use_cache=use_cache)
     
     print(f"🎬 开始下载CID {cid} 的完整弹幕...")
     if video_date:
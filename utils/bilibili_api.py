@@ -4,9 +4,8 @@ import json
 import os
 import random
 import time
-from functools import reduce
 from hashlib import md5
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 from urllib.parse import urlencode
 
 import qrcode
@@ -20,6 +19,15 @@ from .logger import setup_logger
 APPKEY = "4409e2ce8ffd12b8"
 APPSEC = "59b43e04ad6965f34319062b478f83dd"
 
+# wbi 混合密钥的重排表
+MIXIN_KEY_ENC_TAB = (
+    46, 47, 18,  2, 53,  8, 23, 32, 15, 50, 10, 31, 58,  3, 45, 35, 27,
+    43,  5, 49, 33,  9, 42, 19, 29, 28, 14, 39, 12, 38, 41, 13, 37, 48,
+    7,  16, 24, 55, 40, 61, 26, 17,  0,  1, 60, 51, 30,  4, 22, 25, 54,
+    21, 56, 59, 6, 63, 57, 62, 11, 36, 20, 34, 44, 52)
+# 混合密钥缓存时长（秒）
+MIXIN_KEY_TTL = 1800
+
 
 class BilibiliAPI:
     """B站API封装类"""
@@ -29,6 +37,8 @@ class BilibiliAPI:
         self.session = requests.Session()
         self.user_info = UserInfo()
         self.logger = setup_logger("bilibili_api", self.config.log_file)
+        # (混合密钥, 获取时间)
+        self._mixin_key_cache: Optional[Tuple[str, float]] = None
 
         user_agents = [
             "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
@@ -128,8 +138,11 @@ class BilibiliAPI:
                     data = response["data"]
                     return data
                 else:
+                    # 签名可能因混合密钥轮换而失效，重试前重新获取
+                    self._mixin_key_cache = None
                     continue
             except Exception as e:
+                self._mixin_key_cache = None
                 self.logger.error(f"获取用户(mid={mid})视频信息失败：{e}")
         return {}
 
@@ -161,6 +174,8 @@ class BilibiliAPI:
                     f"账号{status}"
                 )
                 return True
+            # 签名可能因混合密钥轮换而失效，下次调用时重新获取
+            self._mixin_key_cache = None
         except Exception as e:
             self.logger.error(f"获取用户信息失败：{e}")
         return False
@@ -170,7 +185,12 @@ class BilibiliAPI:
         return self.session.cookies.get_dict(domain=".bilibili.com")
 
     def get_mixin_key(self) -> str:
-        """获取混合密钥"""
+        """获取混合密钥，在 MIXIN_KEY_TTL 内复用缓存"""
+        if self._mixin_key_cache is not None:
+            mixin_key, fetched_at = self._mixin_key_cache
+            if time.time() - fetched_at < MIXIN_KEY_TTL:
+                return mixin_key
+
         url = "https://api.bilibili.com/x/web-interface/nav"
         response = self._request("get", url, headers=self.api_headers)
 
@@ -186,13 +206,10 @@ class BilibiliAPI:
         sub_value = sub_url.split("/")[-1].split(".")[0]
         ae = img_value + sub_value
 
-        oe = [46, 47, 18,  2, 53,  8, 23, 32, 15, 50, 10, 31, 58,  3, 45, 35, 27,
-              43,  5, 49, 33,  9, 42, 19, 29, 28, 14, 39, 12, 38, 41, 13, 37, 48,
-              7,  16, 24, 55, 40, 61, 26, 17,  0,  1, 60, 51, 30,  4, 22, 25, 54,
-              21, 56, 59, 6, 63, 57, 62, 11, 36, 20, 34, 44, 52]
-
-        le = reduce(lambda s, i: s + ae[i], oe, "")
-        return le[:32]
+        le = "".join([ae[i] for i in MIXIN_KEY_ENC_TAB])
+        mixin_key = le[:32]
+        self._mixin_key_cache = (mixin_key, time.time())
+        return mixin_key
 
     def login_with_cookie(self, cookie_file: Optional[str] = None) -> bool:
         """使用 cookies 进行登录"""
@@ -265,12 +282,19 @@ class BilibiliAPI:
 
         poll_url = "http://passport.bilibili.com/x/passport-tv-login/qrcode/poll"
 
+        # 未扫码时轮询间隔从 1 秒逐步退避到 5 秒；已扫码待确认（86090）时恢复为 1 秒
+        delay = 1.0
         while True:
             poll_response = self._request("post", poll_url, data=params,
                                           headers=self.api_headers)
-            if poll_response and poll_response.get("code") == 0:
+            code = poll_response.get("code") if poll_response else None
+            if code == 0:
                 break
-            time.sleep(3)
+            elif code == 86090:
+                delay = 1.0
+            else:
+                delay = min(delay * 1.5, 5.0)
+            time.sleep(delay)
 
         # 保存 cookie
         temp_cookie = {}